@@ -3,6 +3,10 @@ from typing import List
 
 class Settings(BaseSettings):
     DATABASE_URL: str
+    DB_POOL_SIZE: int = 20
+    DB_MAX_OVERFLOW: int = 40
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
     REDIS_URL: str = "redis://localhost:6379/0"
     RP_ID: str = "localhost"
     RP_NAME: str = "FIDO2 Demo RP"
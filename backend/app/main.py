@@ -1,12 +1,52 @@
+import asyncio
+import contextlib
+import hashlib
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from .config import settings
 from .db import db_ping, Base, engine
 from . import models  # register models
 from .routes import core
 from .routes import fido
+from .usage import flush_usage, flush_periodically
 
-app = FastAPI(title="FIDO2 Backend", version="0.0.4")
+logger = logging.getLogger("uvicorn.error")  # shows up in uvicorn output
+
+def _warm_up():
+    # Pay first-use costs (fido2 option building, cbor, OpenSSL) before traffic
+    _, state = fido.server.authenticate_begin(
+        credentials=[], user_verification=fido.UserVerificationRequirement.DISCOURAGED
+    )
+    fido.cbor_loads(fido.cbor_dumps(state))
+    hashlib.sha256(b"").digest()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("CBOR implementation: %s", fido.CBOR_IMPL)
+    # Outside dev the schema is managed by migrations run out-of-band
+    if settings.ENV == "dev":
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    _warm_up()
+    flusher = asyncio.create_task(flush_periodically())
+    yield
+    flusher.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await flusher
+    try:
+        await flush_usage()
+    finally:
+        await engine.dispose()
+
+app = FastAPI(
+    title="FIDO2 Backend",
+    version="0.0.4",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -16,17 +56,13 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
-@app.on_event("startup")
-def on_startup():
-    Base.metadata.create_all(bind=engine)
-
 @app.get("/healthz")
-def healthz():
-    return {"status": "ok", "db": "up" if db_ping() else "down"}
+async def healthz():
+    return {"status": "ok", "db": "up" if await db_ping() else "down"}
 
 @app.get("/api/healthz")
-def healthz_alias():
-    return healthz()
+async def healthz_alias():
+    return await healthz()
 
 app.include_router(core.router)
 app.include_router(fido.router)
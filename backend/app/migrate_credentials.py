@@ -0,0 +1,48 @@
+"""
+One-off migration for credentials tables created before the cred_hash column
+and the timezone-aware last_used_at. create_all does not alter existing
+tables, so run this once before deploying:
+
+    python -m app.migrate_credentials
+
+- adds cred_hash, backfills it from credential_id, then sets NOT NULL and the index
+- converts last_used_at to timestamptz, reading the old naive values as UTC
+
+Safe to re-run.
+"""
+import asyncio
+from sqlalchemy import text
+from .db import engine
+from .models import credential_fingerprint
+
+async def migrate():
+    async with engine.begin() as conn:
+        await conn.execute(text("ALTER TABLE credentials ADD COLUMN IF NOT EXISTS cred_hash BIGINT"))
+        rows = (
+            await conn.execute(text("SELECT id, credential_id FROM credentials WHERE cred_hash IS NULL"))
+        ).all()
+        if rows:
+            await conn.execute(
+                text("UPDATE credentials SET cred_hash = :h WHERE id = :id"),
+                [{"id": row.id, "h": credential_fingerprint(bytes(row.credential_id))} for row in rows],
+            )
+        await conn.execute(text("ALTER TABLE credentials ALTER COLUMN cred_hash SET NOT NULL"))
+        await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_credentials_cred_hash ON credentials (cred_hash)"))
+
+        # Only convert while still naive; re-running on timestamptz would shift values
+        last_used_type = (
+            await conn.execute(text(
+                "SELECT data_type FROM information_schema.columns "
+                "WHERE table_name = 'credentials' AND column_name = 'last_used_at'"
+            ))
+        ).scalar_one()
+        if last_used_type == "timestamp without time zone":
+            await conn.execute(text(
+                "ALTER TABLE credentials ALTER COLUMN last_used_at TYPE timestamptz "
+                "USING last_used_at AT TIME ZONE 'UTC'"
+            ))
+    await engine.dispose()
+    print(f"credentials migration done, backfilled cred_hash for {len(rows)} row(s)")
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
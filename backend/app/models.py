@@ -1,7 +1,12 @@
-from sqlalchemy import Column, Integer, String, LargeBinary, ForeignKey, DateTime, func
+import hashlib
+from sqlalchemy import Column, BigInteger, Integer, String, LargeBinary, ForeignKey, DateTime, func
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from .db import Base
 
+def credential_fingerprint(credential_id: bytes) -> int:
+    # Fixed-size signed 64-bit key for indexed lookups of variable-length ids
+    return int.from_bytes(hashlib.blake2b(credential_id, digest_size=8).digest(), "big", signed=True)
+
 class User(Base):
     __tablename__ = "users"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
@@ -15,11 +20,12 @@ class Credential(Base):
     __tablename__ = "credentials"
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True, nullable=False)
-    credential_id: Mapped[bytes] = mapped_column(LargeBinary, unique=True, nullable=False)
+    credential_id: Mapped[bytes] = mapped_column(LargeBinary, unique=True, index=True, nullable=False)
+    cred_hash: Mapped[int] = mapped_column(BigInteger, index=True, nullable=False)  # credential_fingerprint(credential_id)
     public_key: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
     sign_count: Mapped[int] = mapped_column(Integer, default=0)
     aaguid: Mapped[str] = mapped_column(String(64), nullable=True)
     transports: Mapped[str] = mapped_column(String(255), nullable=True)  # comma-separated
-    last_used_at: Mapped[DateTime] = mapped_column(DateTime, nullable=True)
+    last_used_at: Mapped[DateTime] = mapped_column(DateTime(timezone=True), nullable=True)
 
     user = relationship("User", back_populates="credentials")
@@ -1,21 +1,38 @@
-from redis import Redis
+from redis.asyncio import BlockingConnectionPool, Redis
 from .config import settings
-import json
+import msgpack
 
-r = Redis.from_url(settings.REDIS_URL)
+# Blocking pool: bursts past max_connections wait for a free connection
+# (up to timeout seconds) instead of failing with "Too many connections"
+pool = BlockingConnectionPool.from_url(
+    settings.REDIS_URL,
+    max_connections=64,
+    timeout=20,
+    socket_keepalive=True,
+    health_check_interval=30,
+)
+r = Redis(connection_pool=pool)
 
 def _key(prefix: str, user: str) -> str:
     return f"{prefix}:{user}"
 
-def set_state(prefix: str, user: str, data: dict, ttl_seconds: int = 300):
-    r.setex(_key(prefix, user), ttl_seconds, json.dumps(data))
+def _pack(data: dict) -> bytes:
+    # msgpack keeps bytes values binary (no base64/JSON round-trip)
+    return msgpack.packb(data, use_bin_type=True)
 
-def pop_state(prefix: str, user: str) -> dict | None:
-    key = _key(prefix, user)
-    pipe = r.pipeline()
-    pipe.get(key)
-    pipe.delete(key)
-    value, _ = pipe.execute()
+async def set_state(prefix: str, user: str, data: dict, ttl_seconds: int = 300):
+    await r.setex(_key(prefix, user), ttl_seconds, _pack(data))
+
+async def set_state_pipeline(ops: list[tuple[str, str, dict, int]]):
+    """Persist several (prefix, user, data, ttl_seconds) states in one round-trip."""
+    async with r.pipeline(transaction=False) as pipe:
+        for prefix, user, data, ttl_seconds in ops:
+            pipe.setex(_key(prefix, user), ttl_seconds, _pack(data))
+        await pipe.execute()
+
+async def pop_state(prefix: str, user: str) -> dict | None:
+    # GETDEL (Redis >= 6.2): atomic read-and-consume in a single command
+    value = await r.getdel(_key(prefix, user))
     if value is None:
         return None
-    return json.loads(value)
+    return msgpack.unpackb(value, raw=False)
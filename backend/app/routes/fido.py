@@ -1,11 +1,15 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from ..db import session_scope, Base, engine
-from ..models import User, Credential
+from fastapi import APIRouter, BackgroundTasks, HTTPException
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from ..db import session_scope
+from ..models import User, Credential, credential_fingerprint
+from ..schemas import RegisterStartIn, RegisterFinishIn, LoginStartIn, LoginFinishIn
 from ..config import settings
 from ..redis_store import set_state, pop_state
 from ..security import issue_token
+from ..usage import record_use, try_flush_usage
 
 # --- fido2 v2.0 imports ---
 from fido2.server import Fido2Server
@@ -22,35 +26,88 @@ from fido2.webauthn import (
 from fido2.utils import websafe_encode, websafe_decode
 
 from fido2.cose import CoseKey
-import cbor2
 import datetime
+import os
+import time
+from functools import lru_cache
 
-router = APIRouter(prefix="/api/v1", tags=["webauthn"])
+# cbor2 binds these to its C extension (_cbor2) when available and falls back
+# to pure Python otherwise. Don't import _cbor2 directly: it needs cbor2's
+# Python-side setup (bytes/enum encoders) and fails without it.
+from cbor2 import dumps as cbor_dumps, loads as cbor_loads
+
+CBOR_IMPL = "C (_cbor2)" if cbor_dumps.__module__ == "_cbor2" else "pure Python (cbor2)"
 
-# Create DB tables on first import (bootstrap)
-Base.metadata.create_all(bind=engine)
+router = APIRouter(prefix="/api/v1", tags=["webauthn"])
 
 rp = PublicKeyCredentialRpEntity(id=settings.RP_ID, name=settings.RP_NAME)
 server = Fido2Server(rp)  # attestation=None by default
 
 # ---------- Helpers ----------
-def get_user(db: Session, username: str) -> User | None:
-    return db.query(User).filter(User.username == username).one_or_none()
+async def get_user(db: AsyncSession, username: str) -> User | None:
+    return (await db.execute(select(User).where(User.username == username))).scalar_one_or_none()
 
-def _cred_descriptor_from_db(cred: Credential) -> PublicKeyCredentialDescriptor:
+async def _credential_ids(db: AsyncSession, *where) -> list[bytes]:
+    # Project only credential_id: skips public_key blobs and ORM hydration
+    stmt = select(Credential.credential_id).where(*where)
+    return list((await db.execute(stmt)).scalars().all())
+
+@lru_cache(maxsize=1024)
+def _user_entity(uid: int, username: str, display_name: str) -> PublicKeyCredentialUserEntity:
+    return PublicKeyCredentialUserEntity(id=str(uid).encode(), name=username, display_name=display_name)
+
+@lru_cache(maxsize=4096)
+def _cred_descriptor(credential_id: bytes) -> PublicKeyCredentialDescriptor:
     # For register/authenticate *begin* (exclude/allow lists)
-    return PublicKeyCredentialDescriptor(type="public-key", id=cred.credential_id)
+    return PublicKeyCredentialDescriptor(type="public-key", id=credential_id)
+
+@lru_cache(maxsize=4096)
+def _attested_from_row(credential_id: bytes, public_key: bytes, aaguid: str | None) -> AttestedCredentialData:
+    # public_key is COSE (CBOR) bytes -> dict -> CoseKey
+    cose_map = cbor_loads(public_key)
+    cose_key = CoseKey.parse(cose_map)
+    aaguid_obj = Aaguid.parse(aaguid) if aaguid else Aaguid.NONE
+    return AttestedCredentialData.create(aaguid=aaguid_obj, credential_id=credential_id, public_key=cose_key)
 
 def _attested_from_db(cred: Credential) -> AttestedCredentialData:
     """
     Build AttestedCredentialData for authenticate_complete.
     We stored the COSE public key bytes in Credential.public_key.
+    Memoized on the stored columns, since a credential's key never changes.
     """
-    # public_key is COSE (CBOR) bytes -> dict -> CoseKey
-    cose_map = cbor2.loads(cred.public_key)
-    cose_key = CoseKey.parse(cose_map)
-    aaguid = Aaguid.parse(cred.aaguid) if cred.aaguid else Aaguid.NONE
-    return AttestedCredentialData.create(aaguid=aaguid, credential_id=cred.credential_id, public_key=cose_key)
+    return _attested_from_row(bytes(cred.credential_id), bytes(cred.public_key), cred.aaguid)
+
+# Per-worker cache of authenticate_begin output. For a fixed credential set the
+# options only differ in the challenge, so hits just re-seed that field.
+AUTH_OPTIONS_TTL = 60
+AUTH_OPTIONS_MAX = 4096
+_auth_options_cache: dict[tuple[str, tuple[bytes, ...]], tuple[float, dict, dict]] = {}
+
+def _authenticate_begin(username: str, cids: list[bytes]) -> tuple[dict, dict]:
+    key = (username, tuple(cids))
+    now = time.monotonic()
+    hit = _auth_options_cache.get(key)
+    if hit and hit[0] > now:
+        _, options, state = hit
+        challenge = websafe_encode(os.urandom(32))
+        options = {**options, "publicKey": {**options["publicKey"], "challenge": challenge}}
+        return options, {**state, "challenge": challenge}
+
+    # fido2 v2.0: authenticate_begin(credentials=..., user_verification=...)
+    request_options, state = server.authenticate_begin(
+        credentials=[_cred_descriptor(cid) for cid in cids],
+        user_verification=UserVerificationRequirement.REQUIRED,
+    )
+    options = dict(request_options)
+    # Only cache if the state carries the challenge the way we re-seed it
+    if state.get("challenge") == options["publicKey"]["challenge"]:
+        if len(_auth_options_cache) >= AUTH_OPTIONS_MAX:
+            for k in [k for k, v in _auth_options_cache.items() if v[0] <= now]:
+                del _auth_options_cache[k]
+            if len(_auth_options_cache) >= AUTH_OPTIONS_MAX:
+                _auth_options_cache.clear()
+        _auth_options_cache[key] = (now + AUTH_OPTIONS_TTL, options, state)
+    return options, state
 
 # ---------- Health ----------
 @router.get("/health")
@@ -59,24 +116,25 @@ def health():
 
 # ---------- Registration ----------
 @router.post("/register/start")
-async def register_start(payload: dict):
-    username = payload.get("username")
-    display_name = payload.get("displayName") or username
-    if not username:
-        raise HTTPException(status_code=400, detail="username required")
+async def register_start(payload: RegisterStartIn):
+    username = payload.username
+    display_name = payload.displayName or username
 
     # Ensure user exists; collect already-registered descriptors
-    with session_scope() as db:
-        user = get_user(db, username)
+    async with session_scope() as db:
+        user = await get_user(db, username)
         if not user:
             user = User(username=username, display_name=display_name)
             db.add(user)
-            db.flush()  # get user.id
+            await db.flush()  # get user.id
+            existing_desc = []
+        else:
+            cids = await _credential_ids(db, Credential.user_id == user.id)
+            existing_desc = [_cred_descriptor(cid) for cid in cids]
 
         uid = int(user.id)  # capture before session closes
-        existing_desc = [_cred_descriptor_from_db(c) for c in user.credentials]
 
-    user_entity = PublicKeyCredentialUserEntity(id=str(uid).encode(), name=username, display_name=display_name)
+    user_entity = _user_entity(uid, username, display_name)
 
     # fido2 v2.0: use register_begin(..., credentials=existing_desc, resident_key_requirement=..., user_verification=..., authenticator_attachment=...)
     options, state = server.register_begin(
@@ -87,57 +145,55 @@ async def register_start(payload: dict):
         authenticator_attachment=None,  # allow both platform/cross-platform
     )
 
-    # Store the state safely: CBOR-encode (handles bytes) then base64url
-    state_blob = cbor2.dumps(state)
-    set_state("reg", username, {"state": websafe_encode(state_blob), "user_id": uid})
+    # Store the state safely: CBOR-encode (handles bytes), kept as raw bytes in msgpack
+    state_blob = cbor_dumps(state)
+    await set_state("reg", username, {"state": state_blob, "user_id": uid})
 
     # options is a JsonDataObject → dict(options) is JSON compatible (v2.0 JSON mapping)
-    return JSONResponse(dict(options))
+    return ORJSONResponse(dict(options))
 
 @router.post("/register/finish")
-async def register_finish(payload: dict):
-    username = payload.get("username")
-    if not username:
-        raise HTTPException(status_code=400, detail="username required")
+async def register_finish(payload: RegisterFinishIn):
+    username = payload.username
 
-    s = pop_state("reg", username)
+    s = await pop_state("reg", username)
     if not s:
         raise HTTPException(status_code=400, detail="registration state expired or missing")
 
-    state_blob = websafe_decode(s["state"])
-    state = cbor2.loads(state_blob)
+    state = cbor_loads(s["state"])
 
     # Build RegistrationResponse mapping (standard JSON field names)
     reg_response = {
-        "id": payload["id"],
-        "rawId": websafe_decode(payload.get("rawId") or payload["id"]),
+        "id": payload.id,
+        "rawId": websafe_decode(payload.rawId or payload.id),
         "type": "public-key",
         "response": {
-            "clientDataJSON": websafe_decode(payload["response"]["clientDataJSON"]),
-            "attestationObject": websafe_decode(payload["response"]["attestationObject"]),
+            "clientDataJSON": websafe_decode(payload.response.clientDataJSON),
+            "attestationObject": websafe_decode(payload.response.attestationObject),
         },
         # optional:
-        "clientExtensionResults": payload.get("clientExtensionResults", {}),
+        "clientExtensionResults": payload.clientExtensionResults,
     }
 
     auth_data = server.register_complete(state, reg_response)
 
     # Persist credential
-    with session_scope() as db:
-        user = get_user(db, username)
+    async with session_scope() as db:
+        user = await get_user(db, username)
         if not user:
             raise HTTPException(status_code=404, detail="user not found")
 
         # COSE public key -> CBOR bytes for storage
-        public_key_cbor = cbor2.dumps(dict(auth_data.credential_data.public_key))
+        public_key_cbor = cbor_dumps(dict(auth_data.credential_data.public_key))
 
         cred = Credential(
             user_id=user.id,
             credential_id=auth_data.credential_data.credential_id,
+            cred_hash=credential_fingerprint(auth_data.credential_data.credential_id),
             public_key=public_key_cbor,
             sign_count=auth_data.counter,
             aaguid=str(auth_data.credential_data.aaguid),
-            transports=",".join(payload.get("transports", []) or []),
+            transports=",".join(payload.transports or []),
         )
         db.add(cred)
 
@@ -145,61 +201,63 @@ async def register_finish(payload: dict):
 
 # ---------- Authentication ----------
 @router.post("/login/start")
-async def login_start(payload: dict):
-    username = payload.get("username")
-    if not username:
-        raise HTTPException(status_code=400, detail="username required")
-
-    with session_scope() as db:
-        user = get_user(db, username)
-        if not user or not user.credentials:
+async def login_start(payload: LoginStartIn):
+    username = payload.username
+
+    async with session_scope() as db:
+        # One joined projection: no rows means no user or no credentials
+        cids = await _credential_ids(
+            db, Credential.user_id == User.id, User.username == username
+        )
+        if not cids:
             raise HTTPException(status_code=404, detail="user or credentials not found")
 
-        allowed_desc = [_cred_descriptor_from_db(c) for c in user.credentials]
+    request_options, state = _authenticate_begin(username, cids)
 
-    # fido2 v2.0: authenticate_begin(credentials=..., user_verification=...)
-    request_options, state = server.authenticate_begin(
-        credentials=allowed_desc,
-        user_verification=UserVerificationRequirement.REQUIRED,
-    )
+    state_blob = cbor_dumps(state)
+    await set_state("auth", username, {"state": state_blob})
 
-    state_blob = cbor2.dumps(state)
-    set_state("auth", username, {"state": websafe_encode(state_blob)})
-
-    return JSONResponse(dict(request_options))
+    return ORJSONResponse(request_options)
 
 @router.post("/login/finish")
-async def login_finish(payload: dict):
-    username = payload.get("username")
-    if not username:
-        raise HTTPException(status_code=400, detail="username required")
+async def login_finish(payload: LoginFinishIn, background_tasks: BackgroundTasks):
+    username = payload.username
 
-    s = pop_state("auth", username)
+    s = await pop_state("auth", username)
     if not s:
         raise HTTPException(status_code=400, detail="authentication state expired or missing")
 
-    state_blob = websafe_decode(s["state"])
-    state = cbor2.loads(state_blob)
+    state = cbor_loads(s["state"])
 
-    cred_id = websafe_decode(payload.get("rawId") or payload["id"])
+    cred_id = websafe_decode(payload.rawId or payload.id)
 
     # Build AuthenticationResponse mapping (standard JSON field names)
     authn_response = {
-        "id": payload["id"],
+        "id": payload.id,
         "rawId": cred_id,
         "type": "public-key",
         "response": {
-            "clientDataJSON": websafe_decode(payload["response"]["clientDataJSON"]),
-            "authenticatorData": websafe_decode(payload["response"]["authenticatorData"]),
-            "signature": websafe_decode(payload["response"]["signature"]),
-            "userHandle": websafe_decode(payload["response"]["userHandle"]) if payload["response"].get("userHandle") else None,
+            "clientDataJSON": websafe_decode(payload.response.clientDataJSON),
+            "authenticatorData": websafe_decode(payload.response.authenticatorData),
+            "signature": websafe_decode(payload.response.signature),
+            "userHandle": websafe_decode(payload.response.userHandle) if payload.response.userHandle else None,
         },
-        "clientExtensionResults": payload.get("clientExtensionResults", {}),
+        "clientExtensionResults": payload.clientExtensionResults,
     }
 
     # Load the single matching credential from DB and create AttestedCredentialData
-    with session_scope() as db:
-        cred = db.query(Credential).filter(Credential.credential_id == cred_id).one_or_none()
+    async with session_scope() as db:
+        cred = (
+            await db.execute(
+                select(Credential)
+                .options(joinedload(Credential.user))
+                # integer index narrows the lookup, the bytes compare confirms it
+                .where(
+                    Credential.cred_hash == credential_fingerprint(cred_id),
+                    Credential.credential_id == cred_id,
+                )
+            )
+        ).scalar_one_or_none()
         if not cred:
             raise HTTPException(status_code=404, detail="credential not found")
 
@@ -208,11 +266,14 @@ async def login_finish(payload: dict):
         # v2.0: authenticate_complete(state, credentials=[AttestedCredentialData], response)
         result = server.authenticate_complete(state, [attested], authn_response)
 
-        # Update sign counter and last used timestamp
+        # Sign counter stays in the transaction (no UPDATE if unchanged)
         cred.sign_count = result.counter
-        cred.last_used_at = datetime.datetime.utcnow()
+        cred_pk = cred.id
+
+        token = issue_token(sub=cred.user.username)
 
-        user = db.query(User).filter(User.id == cred.user_id).one()
-        token = issue_token(sub=user.username)
+    # Last used timestamp is batched, flushed after the response is sent
+    if record_use(cred_pk, datetime.datetime.now(datetime.timezone.utc)):
+        background_tasks.add_task(try_flush_usage)
 
     return {"status": "ok", "token": token}
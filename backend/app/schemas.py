@@ -0,0 +1,36 @@
+from pydantic import BaseModel, Field
+
+# Request bodies for the WebAuthn endpoints (standard JSON field names).
+# Binary fields stay base64url strings; the routes decode them.
+
+class RegisterStartIn(BaseModel):
+    username: str = Field(min_length=1)
+    displayName: str | None = None
+
+class RegisterFinishResponse(BaseModel):
+    clientDataJSON: str
+    attestationObject: str
+
+class RegisterFinishIn(BaseModel):
+    username: str = Field(min_length=1)
+    id: str
+    rawId: str | None = None
+    response: RegisterFinishResponse
+    clientExtensionResults: dict = {}
+    transports: list[str] | None = None
+
+class LoginStartIn(BaseModel):
+    username: str = Field(min_length=1)
+
+class LoginFinishResponse(BaseModel):
+    clientDataJSON: str
+    authenticatorData: str
+    signature: str
+    userHandle: str | None = None
+
+class LoginFinishIn(BaseModel):
+    username: str = Field(min_length=1)
+    id: str
+    rawId: str | None = None
+    response: LoginFinishResponse
+    clientExtensionResults: dict = {}
@@ -1,10 +1,22 @@
+import base64
+import hashlib
+import hmac
 import time
-import jwt
+import orjson
 from .config import settings
 
 ALGO = "HS256"
 
+def _b64url(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+# Header and key are constant, so encode them once instead of per token
+HEADER_B64 = _b64url(orjson.dumps({"alg": ALGO, "typ": "JWT"}))
+_KEY = settings.JWT_SECRET.encode()
+
 def issue_token(sub: str, ttl_seconds: int = 3600) -> str:
     now = int(time.time())
-    payload = {"sub": sub, "iat": now, "exp": now + ttl_seconds}
-    return jwt.encode(payload, settings.JWT_SECRET, algorithm=ALGO)
+    payload_b64 = _b64url(orjson.dumps({"sub": sub, "iat": now, "exp": now + ttl_seconds}))
+    signing_input = HEADER_B64 + b"." + payload_b64
+    sig = hmac.new(_KEY, signing_input, hashlib.sha256).digest()
+    return (signing_input + b"." + _b64url(sig)).decode()
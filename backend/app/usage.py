@@ -0,0 +1,55 @@
+import asyncio
+import datetime
+import logging
+import time
+from sqlalchemy import case, update
+from .db import session_scope
+from .models import Credential
+
+# last_used_at is informational, so it is buffered and written in batches
+# instead of one UPDATE per login.
+FLUSH_EVERY = 100        # pending credentials
+FLUSH_INTERVAL = 5.0     # seconds since the last flush
+
+logger = logging.getLogger("uvicorn.error")
+
+_pending: dict[int, datetime.datetime] = {}
+_last_flush = time.monotonic()
+
+def record_use(cred_pk: int, ts: datetime.datetime) -> bool:
+    """Queue a last_used_at update; returns True when a flush is due."""
+    _pending[cred_pk] = ts
+    return len(_pending) >= FLUSH_EVERY or time.monotonic() - _last_flush >= FLUSH_INTERVAL
+
+async def flush_usage():
+    global _pending, _last_flush
+    batch, _pending = _pending, {}
+    _last_flush = time.monotonic()
+    if not batch:
+        return
+    try:
+        async with session_scope() as db:
+            await db.execute(
+                update(Credential)
+                .where(Credential.id.in_(batch))
+                .values(last_used_at=case(batch, value=Credential.id))
+                .execution_options(synchronize_session=False)
+            )
+    except BaseException:  # includes cancellation of the periodic task
+        # keep the timestamps for the next flush unless newer ones arrived
+        for pk, ts in batch.items():
+            _pending.setdefault(pk, ts)
+        raise
+
+async def try_flush_usage():
+    """flush_usage for background callers: a failed batch is requeued and logged, not raised."""
+    try:
+        await flush_usage()
+    except Exception:
+        logger.exception("last_used_at flush failed; will retry")
+
+async def flush_periodically():
+    """Flush every FLUSH_INTERVAL so quiet workers don't hold updates indefinitely."""
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        await try_flush_usage()
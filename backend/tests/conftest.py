@@ -0,0 +1,22 @@
+import os
+import tempfile
+
+# Settings and the engine are built at import time, so configure them first
+_db_dir = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_db_dir}/test.db")
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.environ.setdefault("ENV", "dev")
+
+import fakeredis
+import pytest
+from fastapi.testclient import TestClient
+
+from app import redis_store
+from app.main import app
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(redis_store, "r", fakeredis.FakeAsyncRedis())
+    with TestClient(app) as c:  # runs the lifespan (create_all + warm-up)
+        yield c
@@ -0,0 +1,35 @@
+import asyncio
+import datetime
+
+from app import usage
+
+
+def test_app_boots(client):
+    # entering the client ran the lifespan: create_all, warm-up, flusher task
+    res = client.get("/healthz")
+    assert res.status_code == 200
+    assert res.json() == {"status": "ok", "db": "up"}
+
+
+def test_register_start_returns_options(client):
+    res = client.post("/api/v1/register/start", json={"username": "alice"})
+    assert res.status_code == 200
+    options = res.json()["publicKey"]
+    assert options["user"]["name"] == "alice"
+    assert options["challenge"]
+
+
+def test_login_start_unknown_user(client):
+    res = client.post("/api/v1/login/start", json={"username": "nobody"})
+    assert res.status_code == 404
+
+
+def test_failed_usage_flush_is_requeued(client, monkeypatch):
+    def broken_scope():
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(usage, "session_scope", broken_scope)
+    usage.record_use(1, datetime.datetime.now(datetime.timezone.utc))
+    asyncio.run(usage.try_flush_usage())  # logs instead of raising
+    assert 1 in usage._pending
+    usage._pending.clear()